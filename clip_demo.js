@@ -21,15 +21,36 @@ export function cosineSimilarity(vecA, vecB) {
     return dotProduct / (Math.sqrt(normA) * Math.sqrt(normB));
 }
 
-function extractDatabase(node, db = []) {
-    if (node.word && node.unsearchable !== true && node.vector) {
+/**
+ * Loads a little-endian float32 .npy matrix (as written by numpy) and returns
+ * one Float32Array view per row, without copying.
+ */
+async function loadNpyRows(url) {
+    const buffer = await (await fetch(url)).arrayBuffer();
+    const view = new DataView(buffer);
+    // Format 1.x stores the header length in 2 bytes, 2.x and later in 4
+    const major = view.getUint8(6);
+    const headerStart = major === 1 ? 10 : 12;
+    const headerLen = major === 1 ? view.getUint16(8, true) : view.getUint32(8, true);
+    const header = new TextDecoder().decode(new Uint8Array(buffer, headerStart, headerLen));
+    const [, numRows, dim] = header.match(/'shape': \((\d+), (\d+)\)/).map(Number);
+
+    // numpy pads the header so the data starts 64-byte aligned
+    const data = new Float32Array(buffer, headerStart + headerLen, numRows * dim);
+    const rows = [];
+    for (let i = 0; i < numRows; i++) rows.push(data.subarray(i * dim, (i + 1) * dim));
+    return rows;
+}
+
+function extractDatabase(node, vectors, db = []) {
+    if (node.word && node.unsearchable !== true && node.vector_idx !== undefined) {
         db.push({
             word: node.word,
-            vector: node.vector
+            vector: vectors[node.vector_idx]
         });
     }
     if (node.children) {
-        for (const child of node.children) extractDatabase(child, db);
+        for (const child of node.children) extractDatabase(child, vectors, db);
     }
     return db;
 }
@@ -44,9 +65,12 @@ async function initializeSearch() {
         clip = new ClipEmbedder();
         await clip.initialize();
 
-        const response = await fetch('./pokemon_type_concepts/creatures.json');
-        const rootNode = await response.json();
-        database = extractDatabase(rootNode);
+        // The tree refers to its CLIP vectors by row in a separate .npy file
+        const [rootNode, vectors] = await Promise.all([
+            fetch('./pokemon_type_concepts/creatures.json').then(response => response.json()),
+            loadNpyRows('./pokemon_type_concepts/creatures_vectors.npy'),
+        ]);
+        database = extractDatabase(rootNode, vectors);
 
         document.getElementById('search-btn').disabled = false;
         document.getElementById('image-upload').disabled = false;
@@ -5,9 +5,13 @@ import json
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-import tensorflow as tf
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import squareform
 import keras
-from sklearn.metrics.pairwise import cosine_similarity
+
+# Registers the custom layers (ReversibleEmbedding, PositionalEmbedding) that
+# load_assets_and_weights needs to deserialize best_poke_model.keras
+import transformer_layers  # noqa: F401
 
 # --- 1. EXTRACTION & FILTERING ---
 
@@ -31,7 +35,7 @@ def get_valid_ipa_chars(tsv_path):
 def load_assets_and_weights(model_path, vocab_path):
     """Loads model, vocab, and extracts raw embedding weights."""
     print("Loading model and vocabulary...")
-    model = keras.models.load_model(model_path)
+    model = keras.models.load_model(model_path, compile=False)
 
     with open(vocab_path, "r") as f:
         vocab = json.load(f)
@@ -68,14 +72,26 @@ def create_ipa_subset(vocab, weights, valid_chars):
 
     return ipa_vocab, inv_ipa_vocab, ipa_weights
 
+
+def cosine_similarity_matrix(weights):
+    """Pairwise cosine similarity of the rows: normalize once, then a single matmul."""
+    # float32 is plenty for a plot and a confusion matrix, and halves the bandwidth
+    weights = np.asarray(weights, dtype=np.float32)
+    norm = weights / np.linalg.norm(weights, axis=1, keepdims=True)
+    return norm @ norm.T
+
 # --- 2. VISUALIZATION ---
 
 
-def plot_ipa_similarity(ipa_weights, ipa_vocab, output_img="ipa_clusters.png"):
+def plot_ipa_similarity(sim_matrix, ipa_vocab, output_img="ipa_clusters.png"):
     """Generates a hierarchical clustermap using strictly IPA characters."""
     ipa_labels = list(ipa_vocab.keys())
 
-    sim_matrix = cosine_similarity(ipa_weights)
+    # The matrix is symmetric, so one linkage (on cosine distance) serves both
+    # axes and seaborn doesn't have to cluster the rows and columns itself.
+    dist = 1 - sim_matrix
+    np.fill_diagonal(dist, 0)
+    Z = linkage(squareform(dist, checks=False), method="average")
 
     # Normalize to 0.0 - 1.0 range for the heatmap
     sim_matrix = (sim_matrix + 1) / 2
@@ -85,6 +101,8 @@ def plot_ipa_similarity(ipa_weights, ipa_vocab, output_img="ipa_clusters.png"):
 
     g = sns.clustermap(
         sim_matrix,
+        row_linkage=Z,
+        col_linkage=Z,
         xticklabels=ipa_labels,
         yticklabels=ipa_labels,
         cmap="magma",
@@ -101,50 +119,104 @@ def plot_ipa_similarity(ipa_weights, ipa_vocab, output_img="ipa_clusters.png"):
 # --- 3. CONFUSION MATRIX ---
 
 
-def get_tunable_confusion_matrix(ipa_weights, top_k=5, sensitivity=15.0):
+def get_tunable_confusion_matrix(sim_matrix, top_k=5, sensitivity=15.0):
     """
     Creates a probability matrix for phonetic confusion strictly within the IPA subset.
     """
     print(f"Generating tunable confusion matrix (top_k={top_k}, sensitivity={sensitivity})...")
-    sim_matrix = cosine_similarity(ipa_weights)
+    # Work on a copy; the caller's matrix is shared with the plot
+    sim_matrix = sim_matrix.copy()
 
     # Mask the diagonal (set self-similarity to 0)
     np.fill_diagonal(sim_matrix, 0)
 
-    # Top-K Masking
+    # Top-K Masking (argpartition finds every row's top K without a full sort)
     masked_sim = np.full_like(sim_matrix, -np.inf)
-    for i in range(len(sim_matrix)):
-        top_indices = np.argsort(sim_matrix[i])[-top_k:]
-        masked_sim[i, top_indices] = sim_matrix[i, top_indices]
+    top_indices = np.argpartition(sim_matrix, -top_k, axis=1)[:, -top_k:]
+    rows = np.arange(len(sim_matrix))[:, None]
+    masked_sim[rows, top_indices] = sim_matrix[rows, top_indices]
 
-    # Sensitivity Scaling
-    scaled_sim = masked_sim * sensitivity
+    # Sensitivity Scaling (in place from here on, so no temporaries)
+    prob_matrix = masked_sim
+    prob_matrix *= sensitivity
 
-    # Softmax
-    exp_sim = np.exp(scaled_sim - np.max(scaled_sim, axis=1, keepdims=True))
-    prob_matrix = exp_sim / np.sum(exp_sim, axis=1, keepdims=True)
+    # Softmax. The -inf entries from the top-K mask exponentiate to 0.
+    prob_matrix -= prob_matrix.max(axis=1, keepdims=True)
+    np.exp(prob_matrix, out=prob_matrix)
+    prob_matrix /= prob_matrix.sum(axis=1, keepdims=True)
 
     return prob_matrix
 
 
-def apply_confusion(word, prob_matrix, ipa_vocab, inv_ipa_vocab, mutation_rate=0.2):
-    """Randomly mutates characters based strictly on the IPA confusion matrix."""
-    tweaked_chars = []
+def apply_confusion(word, cdf_matrix, ipa_vocab, inv_ipa_vocab, mutation_rate=0.2):
+    """
+    Randomly mutates characters based strictly on the IPA confusion matrix.
+    Takes the row-wise CDF of the probability matrix (np.cumsum(..., axis=1)).
+    """
+    # Keep originals by default (preserves spaces, unmutated IPA, or standard English letters if present)
+    tweaked_chars = list(word)
+
+    # Only attempt mutation if the character is in our strict IPA subset
+    in_subset = np.array([char in ipa_vocab for char in word], dtype=bool)
+    positions = np.flatnonzero(in_subset & (np.random.rand(len(word)) < mutation_rate))
+    if len(positions) == 0:
+        return word
+
+    # Sample a new IPA character for every mutated position in one pass:
+    # the new index is the number of CDF entries below a uniform draw.
+    rows = np.array([ipa_vocab[word[pos]] for pos in positions])
+    draws = np.random.rand(len(rows))
+    new_indices = (cdf_matrix[rows] < draws[:, None]).sum(axis=1)
+    # Guard against float round-off leaving the last CDF entry just under 1
+    new_indices = np.minimum(new_indices, cdf_matrix.shape[1] - 1)
+
+    for pos, new_idx in zip(positions, new_indices):
+        tweaked_chars[pos] = inv_ipa_vocab[new_idx]
 
-    for char in word:
-        # Only attempt mutation if the character is in our strict IPA subset
-        if char in ipa_vocab and np.random.rand() < mutation_rate:
-            idx = ipa_vocab[char]
-            probs = prob_matrix[idx]
+    return "".join(tweaked_chars)
 
-            # Sample a new IPA character based on the probabilities
-            new_idx = np.random.choice(len(probs), p=probs)
-            tweaked_chars.append(inv_ipa_vocab[new_idx])
-        else:
-            # Keep original (preserves spaces, unmutated IPA, or standard English letters if present)
-            tweaked_chars.append(char)
 
-    return "".join(tweaked_chars)
+def generate_confusion_variants(word, cdf_matrix, ipa_vocab, inv_ipa_vocab,
+                                num_variants=20, mutation_rate=0.2, batch_size=64,
+                                max_batch_size=4096, max_rounds=50):
+    """
+    Collects distinct mutated variants of a word. Each round mutates a whole
+    batch of candidates at once instead of calling apply_confusion per variant.
+
+    A word may have fewer than num_variants reachable variants (e.g. when few
+    of its characters are in the IPA subset), so sampling stops after
+    max_rounds and returns the distinct variants found so far.
+    """
+    chars = np.array(list(word), dtype=object)
+    in_subset = np.array([char in ipa_vocab for char in word], dtype=bool)
+    # Rows for characters outside the subset are never used (masked out below)
+    rows = np.array([ipa_vocab.get(char, 0) for char in word], dtype=int)
+    ipa_chars = np.array([inv_ipa_vocab[i] for i in range(len(inv_ipa_vocab))], dtype=object)
+    word_cdfs = cdf_matrix[rows]  # (len(word), num_ipa)
+
+    variants = {}  # Ordered set: keeps the first num_variants found
+    for _round in range(max_rounds):
+        if len(variants) == num_variants:
+            break
+
+        # Mutation decisions and replacement draws for every (candidate, position)
+        mutate = in_subset & (np.random.rand(batch_size, len(word)) < mutation_rate)
+        draws = np.random.rand(batch_size, len(word))
+        new_indices = (word_cdfs[None, :, :] < draws[:, :, None]).sum(axis=2)
+        new_indices = np.minimum(new_indices, cdf_matrix.shape[1] - 1)
+        candidates = np.where(mutate, ipa_chars[new_indices], chars)
+
+        for candidate in candidates:
+            tweaked_ipa = "".join(candidate)
+            if tweaked_ipa != word:
+                variants[tweaked_ipa] = None
+            if len(variants) == num_variants:
+                break
+
+        # Still short? Low mutation rates mostly reproduce the original.
+        batch_size = min(batch_size * 2, max_batch_size)
+
+    return list(variants)
 
 
 # --- 4. EXECUTION ---
@@ -167,28 +239,27 @@ if __name__ == "__main__":
         ipa_vocab, inv_ipa_vocab, ipa_weights = create_ipa_subset(
             vocab, weights, valid_ipa_chars)
 
+        # Both the plot and the confusion matrix start from the same similarities
+        sim_matrix = cosine_similarity_matrix(ipa_weights)
+
         # 4. Generate and save the plot
-        plot_ipa_similarity(ipa_weights, ipa_vocab)
+        plot_ipa_similarity(sim_matrix, ipa_vocab)
 
         # 5. Create the confusion matrix
         prob_matrix = get_tunable_confusion_matrix(
-            ipa_weights, top_k=3, sensitivity=15.0)
+            sim_matrix, top_k=3, sensitivity=15.0)
+
+        # Per-row CDFs, so sampling a replacement is a single comparison
+        cdf_matrix = np.cumsum(prob_matrix, axis=1)
 
         # 6. Demonstrate the "Pronunciation Tweaker"
         original_ipa = "pɪkətʃu"  # Example: Pikachu
         print(f"\nTesting Confusion Matrix on: '{original_ipa}' (Mutation Rate: 100%)")
 
-        variants_left = 20
-        variants = set()
-        while len(variants) < 20:
-            # Set mutation rate high just to see the matrix at work!
-            tweaked_ipa = apply_confusion(
-                original_ipa, prob_matrix, ipa_vocab, inv_ipa_vocab, mutation_rate=0.05)
-            if tweaked_ipa == original_ipa:
-                continue
-            if tweaked_ipa in variants:
-                continue
-            variants.add(tweaked_ipa)
+        # Set mutation rate high just to see the matrix at work!
+        variants = generate_confusion_variants(
+            original_ipa, cdf_matrix, ipa_vocab, inv_ipa_vocab,
+            num_variants=20, mutation_rate=0.05)
 
         for variant in sorted(variants):
             print(f"Variant: {variant}")
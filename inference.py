@@ -3,12 +3,15 @@ import os
 os.environ["KERAS_BACKEND"] = "tensorflow"
 
 import keras
+import collections
 import json
 import numpy as np
 import random
 from tabulate import tabulate
 import tensorflow as tf
 
+import transformer_layers  # also registers the model's custom layers
+
 print(f"TF Version: {tf.__version__}")
 print(f"Keras Version: {keras.__version__}")
 print("Physical Devices:", tf.config.list_physical_devices())
@@ -19,11 +22,217 @@ MAX_LEN = 40  # Must match the value used in training!
 
 # Load the trained model
 print("Loading model...")
-model = keras.models.load_model("best_poke_model.keras") #, safe_mode=False)
+model = keras.models.load_model("best_poke_model.keras", compile=False) #, safe_mode=False)
+# Training keeps logits; decoding wants next-token probabilities
+model = transformer_layers.with_softmax(model)
+
+
+def split_encoder_decoder(model):
+    """
+    Splits the trained model into encoder and decoder sub-models, so the
+    encoder only has to run once per word instead of once per decoding step.
+    The encoder output is whatever feeds the decoder's cross-attention.
+    """
+    enc_out = None
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.MultiHeadAttention):
+            query, value = layer._inbound_nodes[0].input_tensors[:2]
+            if query is not value:
+                enc_out = value
+                break
+
+    if enc_out is None:
+        raise ValueError(
+            "Could not find the cross-attention layer. Check model.summary().")
+
+    encoder = keras.Model(model.inputs[0], enc_out)
+    decoder = keras.Model([enc_out, model.inputs[1]], model.output)
+    return encoder, decoder
+
+
+encoder_model, decoder_model = split_encoder_decoder(model)
+
+
+@tf.function(reduce_retracing=True)
+def encoder_step(enc_tensor):
+    return encoder_model(enc_tensor, training=False)
+
 
 @tf.function(reduce_retracing=True)
-def model_step(enc_tensor, dec_input):
-    return model([enc_tensor, dec_input], training=False)
+def decoder_step(enc_out, dec_input):
+    return decoder_model([enc_out, dec_input], training=False)
+
+
+class CachedDecoder:
+    """
+    Step-at-a-time version of the decoder. Instead of re-running the whole
+    padded prefix every step, each call only feeds the newest token and
+    attends over self-attention keys/values cached from earlier steps.
+    Cross-attention keys/values are computed once from the encoder output.
+
+    This mirrors the single decoder block built by train.py's
+    build_transformer, and raises ValueError for any other layout. The
+    cache math runs in float32 even for mixed precision models; layer
+    outputs are cast back with _f32.
+    """
+
+    def __init__(self, decoder):
+        def find(layer_type):
+            return [op for op in decoder.operations if isinstance(op, layer_type)]
+
+        embeddings = find(keras.layers.Embedding)
+        attentions = find(keras.layers.MultiHeadAttention)
+        self.norms = find(keras.layers.LayerNormalization)
+        self.denses = find(keras.layers.Dense)
+        activations = find(keras.layers.Activation)
+
+        # Positions come from a (trained) PositionalEmbedding layer, or in
+        # older models were added as a constant table when the model was built
+        try:
+            pos_tables = [
+                layer.embeddings
+                for layer in find(transformer_layers.PositionalEmbedding)
+            ] + [
+                arg[0] for op in decoder.operations
+                for arg in op._inbound_nodes[0].arguments.args
+                if isinstance(arg, tf.Tensor)
+            ]
+        except (AttributeError, IndexError) as e:
+            raise ValueError(f"Keras internals changed: {e}") from e
+
+        layout = (len(embeddings), len(attentions), len(self.norms),
+                  len(self.denses), len(pos_tables))
+        if layout[:3] + layout[4:] != (1, 2, 3, 1):
+            raise ValueError(f"Unexpected decoder layout: {layout}")
+
+        self.token_emb = embeddings[0]
+        if len(self.denses) == 3:
+            # Separate softmax Dense head
+            self.head = self.denses[2]
+        elif (len(self.denses) == 2 and len(activations) == 1
+                and isinstance(self.token_emb, transformer_layers.ReversibleEmbedding)):
+            # Output projection tied to the token embedding
+            self.head = lambda y: activations[0](self.token_emb(y, reverse=True))
+        else:
+            raise ValueError(f"Unexpected decoder layout: {layout}")
+        self.self_attn, self.cross_attn = attentions
+        try:
+            self.self_proj = _projections(self.self_attn)
+            self.cross_proj = _projections(self.cross_attn)
+        except AttributeError as e:
+            raise ValueError(f"Keras internals changed: {e}") from e
+        self.pos_table = pos_tables[0]
+        # Models trained with length bucketing take any decoder length up to
+        # their position table
+        self.max_len = decoder.inputs[1].shape[1] or self.pos_table.shape[0]
+
+        self.step = tf.function(self._step, reduce_retracing=True)
+
+        if not keras.__version__.startswith(KV_CACHE_KERAS_VERSION + "."):
+            try:
+                self._check_against(decoder)
+            except (AttributeError, TypeError) as e:
+                raise ValueError(f"Keras internals changed: {e}") from e
+
+    def _check_against(self, decoder, steps=3, atol=1e-2):
+        """
+        Raises ValueError unless a few cached steps match the full decoder.
+        Run on Keras versions the cache was not checked against, where the
+        private attributes may still exist but compute something else.
+        """
+        enc_shape = decoder.inputs[0].shape
+        enc_out = tf.random.stateless_normal(
+            [1, enc_shape[1] or 8, enc_shape[2]], seed=[0, 0])
+        tokens = tf.range(1, steps + 1)
+        dec_input = tf.pad(tokens, [[0, self.max_len - steps]])[None, :]
+        full = _f32(decoder([enc_out, dec_input], training=False))
+
+        cache = self.start(enc_out)
+        for t in range(steps):
+            probs, cache = self.step(cache, tokens[t:t + 1], tf.constant(t))
+            diff = float(tf.reduce_max(tf.abs(probs - full[:, t])))
+            if not diff <= atol:
+                raise ValueError(
+                    f"cached step {t} differs from the full decoder by {diff:.3g} "
+                    f"on Keras {keras.__version__}")
+
+    def start(self, enc_out):
+        """Returns the initial cache for a batch of encoder outputs."""
+        rows = tf.shape(enc_out)[0]
+        heads = self.self_attn.num_heads
+        self_k = tf.zeros([rows, self.max_len, heads, self.self_attn.key_dim])
+        self_v = tf.zeros([rows, self.max_len, heads, self.self_attn.value_dim])
+        cross_k = _f32(self.cross_proj.key(enc_out))
+        cross_v = _f32(self.cross_proj.value(enc_out))
+        return self_k, self_v, cross_k, cross_v
+
+    def reorder(self, cache, rows):
+        """Re-points the self-attention cache at the surviving parent beams."""
+        self_k, self_v, cross_k, cross_v = cache
+        # Beams never move between inputs, so the cross-attention cache stays put.
+        return tf.gather(self_k, rows), tf.gather(self_v, rows), cross_k, cross_v
+
+    def _step(self, cache, tokens, t):
+        """Feeds tokens (rows,) at position t. Returns next-token probs (rows, vocab)."""
+        self_k, self_v, cross_k, cross_v = cache
+
+        x = _f32(self.token_emb(tokens[:, None])) + _f32(self.pos_table[t:t + 1])
+
+        # Write this position's keys/values into slot t of the cache
+        slot = tf.reshape(tf.one_hot(t, self.max_len), [1, self.max_len, 1, 1])
+        self_k = self_k * (1 - slot) + _f32(self.self_proj.key(x)) * slot
+        self_v = self_v * (1 - slot) + _f32(self.self_proj.value(x)) * slot
+
+        # 1. Self-Attention (Causal: only the slots written so far)
+        causal_mask = tf.range(self.max_len) <= t
+        attn_output = self._attend(
+            self.self_proj, self.self_attn.key_dim, x, self_k, self_v, causal_mask)
+        y = _f32(self.norms[0](x + attn_output))
+
+        # 2. Cross-Attention
+        attn_output = self._attend(
+            self.cross_proj, self.cross_attn.key_dim, y, cross_k, cross_v)
+        y = _f32(self.norms[1](y + attn_output))
+
+        # 3. Feed-Forward
+        ffn_output = _f32(self.denses[1](self.denses[0](y)))
+        y = _f32(self.norms[2](y + ffn_output))
+
+        probs = _f32(self.head(y))[:, 0, :]
+        return probs, (self_k, self_v, cross_k, cross_v)
+
+    @staticmethod
+    def _attend(proj, key_dim, x, keys, values, mask=None):
+        query = _f32(proj.query(x)) / np.sqrt(key_dim)
+        scores = tf.einsum("bqhk,bthk->bhqt", query, keys)
+        if mask is not None:
+            scores = tf.where(mask, scores, -1e9)
+        weights = tf.nn.softmax(scores, axis=-1)
+        return _f32(proj.output(tf.einsum("bhqt,bthv->bqhv", weights, values)))
+
+
+def _f32(x):
+    """Casts a (possibly reduced precision) layer output to float32."""
+    return tf.cast(x, tf.float32)
+
+
+# MultiHeadAttention keeps its projections in private attributes; these were
+# checked against Keras 3.15. Other versions get a numeric self-check first.
+KV_CACHE_KERAS_VERSION = "3.15"
+_Projections = collections.namedtuple("_Projections", "query key value output")
+
+
+def _projections(mha):
+    """Returns the Dense projections inside a MultiHeadAttention layer."""
+    return _Projections(
+        mha._query_dense, mha._key_dense, mha._value_dense, mha._output_dense)
+
+
+try:
+    cached_decoder = CachedDecoder(decoder_model)
+except ValueError as e:
+    print(f"KV cache unavailable ({e}), decoding full prefixes instead.")
+    cached_decoder = None
 
 
 # Load the vocabulary
@@ -32,132 +241,193 @@ with open("vocab.json", "r") as f:
 
 # Invert vocab (ID -> Char) for decoding
 inv_vocab = {v: k for k, v in vocab.items()}
+# Same mapping as a tuple indexed by ID; gaps decode to "".
+INV_VOCAB = tuple(inv_vocab.get(i, "") for i in range(max(inv_vocab) + 1))
 
 # Special Token IDs
 START_TOKEN = vocab["["]
 STOP_TOKEN = vocab["]"]
 PAD_TOKEN = vocab["[PAD]"]
 
+# Codepoint -> token ID lookup table, so inputs are encoded in one numpy pass
+# instead of a dict lookup per character. Unknown characters map to 0.
+MAX_CODEPOINT = max(ord(c) for c in vocab if len(c) == 1) + 1
+CHAR_LUT = np.zeros(MAX_CODEPOINT, dtype=np.int32)
+for char, idx in vocab.items():
+    if len(char) == 1:
+        CHAR_LUT[ord(char)] = idx
+
+
+def encode_input(text, task_token):
+    """Encodes task_token + text as a (MAX_LEN,) array of token IDs, padded."""
+    codepoints = np.frombuffer(
+        (task_token + text.lower()).encode("utf-32-le"), dtype=np.uint32)[:MAX_LEN]
+    known = codepoints < MAX_CODEPOINT
+
+    enc_ids = np.full(MAX_LEN, PAD_TOKEN, dtype=np.int32)
+    enc_ids[:len(codepoints)] = np.where(known, CHAR_LUT[codepoints * known], 0)
+    return enc_ids
+
 
 # Optimized Beam Search with Batching
-def decode_sequence_beam_batched(input_text, task_token, beam_width=3):
-    full_text = task_token + input_text.lower()
-    enc_ids = [vocab.get(c, 0) for c in full_text]
-    enc_ids = enc_ids[:MAX_LEN]
-    enc_ids += [PAD_TOKEN] * (MAX_LEN - len(enc_ids))
+def decode_sequences_beam_batched(input_texts, task_token, beam_width=3):
+    """Beam searches every input in one batch; rows are grouped per input."""
+    num_inputs = len(input_texts)
+    num_rows = num_inputs * beam_width
+
+    # Shape: (num_inputs, MAX_LEN) -> e.g. (3, 40)
+    enc_tensor = tf.convert_to_tensor(
+        np.stack([encode_input(text, task_token) for text in input_texts]))
 
-    # Shape: (beam_width, MAX_LEN) -> e.g. (3, 40)
-    enc_tensor = tf.convert_to_tensor([enc_ids] * beam_width, dtype=tf.int32)
+    # The encoder doesn't depend on the decoder input (or the beam), so run it
+    # once per input up front and share the output across that input's beams.
+    # Shape: (num_inputs * beam_width, MAX_LEN, embed_dim)
+    enc_out = tf.repeat(encoder_step(enc_tensor), beam_width, axis=0)
 
     # 2. INITIALIZE BEAMS
     # Beams are now kept as parallel lists/arrays
     # If we start all scores at 0, we get 3 identical beams.
-    scores = tf.constant([0.0] + [-1e9] * (beam_width - 1))
-
-    # Sequences: (beam_width, 1) -> [[START], [START], [START]]
-    sequences = tf.constant([[START_TOKEN]] * beam_width, dtype=tf.int32)
-
-    # Track which beams have finished
+    # Shape: (num_inputs, beam_width)
+    scores = tf.constant([[0.0] + [-1e9] * (beam_width - 1)] * num_inputs)
+
+    # Sequences live in a fixed (num_rows, MAX_LEN) buffer, PAD past seq_len,
+    # so each step only writes one new column and the decoder input never
+    # changes shape. -> [[START, PAD, ...], [START, PAD, ...], ...]
+    sequences = tf.Variable(tf.fill([num_rows, MAX_LEN], PAD_TOKEN))
+    sequences[:, 0].assign(tf.fill([num_rows], START_TOKEN))
+    seq_len = 1
+
+    if cached_decoder is not None:
+        cache = cached_decoder.start(enc_out)
+
+    # Which input each row belongs to, and where that input's beams start
+    row_inputs = tf.repeat(tf.range(num_inputs), beam_width)
+    row_offsets = tf.range(num_inputs)[:, None] * beam_width
+
+    # Track which beams have finished. Each step appends the (possibly empty)
+    # batch of beams that emitted STOP there; they're sorted out per input
+    # once decoding is done.
     finished_seqs = []
     finished_scores = []
+    finished_inputs = []
+    # Best length-normalized finished score per input, for early termination
+    best_finished = tf.fill([num_inputs], -np.inf)
 
     # 3. AUTOREGRESSIVE LOOP
     for i in range(MAX_LEN - 1):
-        # A. PREPARE DECODER INPUT
-        # Pad current sequences to (beam_width, MAX_LEN-1)
-        # We need manual padding here because TF tensor shapes are strict
-        curr_len = sequences.shape[1]
-        pad_size = (MAX_LEN - 1) - curr_len
-
-        if pad_size > 0:
-            paddings = tf.constant([[0, 0], [0, pad_size]])  # (batch, time)
-            dec_input = tf.pad(sequences, paddings, constant_values=PAD_TOKEN)
+        if cached_decoder is not None:
+            # A/B. INCREMENTAL INFERENCE: feed only the newest token of each
+            # beam; earlier positions come from the cache.
+            # Output Shape: (num_rows, vocab_size)
+            next_token_logits, cache = cached_decoder.step(
+                cache, sequences[:, i], tf.constant(i))
         else:
-            dec_input = sequences
+            # A. PREPARE DECODER INPUT
+            # The buffer is already PAD-filled past seq_len: (num_rows, MAX_LEN-1)
+            dec_input = sequences[:, :MAX_LEN - 1]
 
-        # B. BATCHED INFERENCE (One call for all beams!)
-        # Output Shape: (beam_width, MAX_LEN-1, vocab_size)
-        preds = model_step(enc_tensor, dec_input)
+            # B. BATCHED INFERENCE (One call for all beams of all inputs!)
+            # Output Shape: (num_rows, MAX_LEN-1, vocab_size)
+            preds = decoder_step(enc_out, dec_input)
 
-        # Get logits for the last token only: (beam_width, vocab_size)
-        next_token_logits = preds[:, curr_len - 1, :]
+            # Get logits for the last token only: (num_rows, vocab_size)
+            next_token_logits = preds[:, i, :]
 
-        # Convert to Log Probs: (beam_width, vocab_size)
+        # Convert to Log Probs: (num_rows, vocab_size)
         log_probs = tf.nn.log_softmax(next_token_logits)
 
         # C. EXPAND BEAMS
         # Add current beam scores to the new log probs
         # score[b] + log_prob[b, v]
-        # Shape: (beam_width, vocab_size)
-        candidate_scores = tf.expand_dims(scores, axis=1) + log_probs
+        # Shape: (num_rows, vocab_size)
+        candidate_scores = tf.reshape(scores, [-1, 1]) + log_probs
 
-        # Flatten to find top K across ALL beams * ALL vocab
-        # Shape: (beam_width * vocab_size,)
-        flat_scores = tf.reshape(candidate_scores, [-1])
+        # Flatten to find top K across ALL beams * ALL vocab of each input
+        # Shape: (num_inputs, beam_width * vocab_size)
+        flat_scores = tf.reshape(candidate_scores, [num_inputs, -1])
 
-        # Top K scores and indices
+        # Top K scores and indices: (num_inputs, beam_width)
         top_k_scores, top_k_indices = tf.math.top_k(flat_scores, k=beam_width)
 
-        # D. RECONSTRUCT BEAMS
+        # D. RECONSTRUCT BEAMS (vectorized, no per-beam Python work)
         vocab_size = log_probs.shape[-1]
         beam_indices = top_k_indices // vocab_size
-        token_indices = top_k_indices % vocab_size
-
-        next_sequences = []
-        next_scores = []
-
-        # Update sequences
-        for k in range(beam_width):
-            beam_idx = beam_indices[k]
-            token = token_indices[k]
-            score = top_k_scores[k]
-
-            # If token is STOP, move to finished list
-            if token == STOP_TOKEN:
-                finished_seqs.append(sequences[beam_idx])
-                finished_scores.append(score)
-                dummy_seq = tf.concat([sequences[beam_idx], [PAD_TOKEN]], axis=0)
-                next_sequences.append(dummy_seq)
-                next_scores.append(-1e9) # Kill this beam
-            else:
-                new_seq = tf.concat([sequences[beam_idx], [token]], axis=0)
-                next_sequences.append(new_seq)
-                next_scores.append(score)
-        # Stack back into tensors for next loop
-        sequences = tf.stack(next_sequences)  # (beam_width, seq_len + 1)
-        scores = tf.stack(next_scores)
+        token_indices = tf.reshape(top_k_indices % vocab_size, [-1])
+        top_k_scores = tf.reshape(top_k_scores, [-1])
+
+        # Row of each winner's parent beam: (num_rows,)
+        parent_rows = tf.reshape(beam_indices + row_offsets, [-1])
+        sequences.assign(tf.gather(sequences, parent_rows))
+
+        # If token is STOP, move to finished list
+        finished_mask = token_indices == STOP_TOKEN
+        finished_seqs.append(
+            tf.boolean_mask(sequences[:, :seq_len], finished_mask))
+        finished_scores.append(tf.boolean_mask(top_k_scores, finished_mask))
+        finished_inputs.append(tf.boolean_mask(row_inputs, finished_mask))
+        best_finished = tf.maximum(best_finished, tf.math.unsorted_segment_max(
+            tf.where(finished_mask, top_k_scores / seq_len**0.7, -np.inf),
+            row_inputs, num_inputs))
+
+        # Finished beams stay in place as PAD-extended dummies, and are killed
+        next_tokens = tf.where(finished_mask, PAD_TOKEN, token_indices)
+        sequences[:, seq_len].assign(next_tokens)
+        seq_len += 1
+        scores = tf.reshape(
+            tf.where(finished_mask, -1e9, top_k_scores), [num_inputs, beam_width])
+        if cached_decoder is not None:
+            cache = cached_decoder.reorder(cache, parent_rows)
 
         # Early Exit: If all active beams are terrible (very low score), stop
         if tf.reduce_max(scores) < -1e8:
             print("EARLY BREAK!", i)
             break
 
-    # 4. SELECT BEST
-    # If we have finished sequences, pick best.
-    # If loop finished without STOP token, pick best active beam.
-    if len(finished_scores) > 0:
-        # Apply penalty: score / (len^alpha)
-        # Using a simple length normalization for starters:
-        # TODO: alpha as a parameter?
-        normalized_scores = [
-            s / (len(seq)**0.7) for s, seq in zip(finished_scores, finished_seqs)
-        ]
-        best_idx = np.argmax(normalized_scores)
-        best_seq = finished_seqs[best_idx].numpy()
-    else:
-        best_idx = np.argmax(scores)
-        best_seq = sequences[best_idx].numpy()
-
-    # Decode
-    decoded_chars = []
-    for idx in best_seq:
-        if idx == START_TOKEN:
-            continue
-        if idx == STOP_TOKEN:
+        # Done once no active beam can beat its input's best finished one:
+        # scores only drop as beams grow, so the best an active beam can
+        # still reach after length normalization is score / MAX_LEN**0.7.
+        best_possible = tf.reduce_max(scores, axis=1) / MAX_LEN**0.7
+        if tf.reduce_all(best_finished > best_possible):
             break
-        decoded_chars.append(inv_vocab.get(idx, ""))
 
-    return "".join(decoded_chars)
+    # 4. SELECT BEST
+    # Group the finished beams by input, in the order they finished
+    finished = [[] for _ in range(num_inputs)]
+    for seqs, seq_scores, inputs in zip(finished_seqs, finished_scores, finished_inputs):
+        for seq, score, n in zip(seqs.numpy(), seq_scores.numpy(), inputs.numpy()):
+            finished[n].append((score, seq))
+
+    results = []
+    for n in range(num_inputs):
+        # If we have finished sequences, pick best.
+        # If loop finished without STOP token, pick best active beam.
+        if len(finished[n]) > 0:
+            # Apply penalty: score / (len^alpha)
+            # Using a simple length normalization for starters:
+            # TODO: alpha as a parameter?
+            normalized_scores = [s / (len(seq)**0.7) for s, seq in finished[n]]
+            best_idx = np.argmax(normalized_scores)
+            best_seq = finished[n][best_idx][1]
+        else:
+            best_idx = n * beam_width + np.argmax(scores[n])
+            best_seq = sequences[best_idx, :seq_len].numpy()
+
+        # Decode
+        decoded_chars = []
+        for idx in best_seq:
+            if idx == START_TOKEN:
+                continue
+            if idx == STOP_TOKEN:
+                break
+            decoded_chars.append(INV_VOCAB[idx])
+
+        results.append("".join(decoded_chars))
+
+    return results
+
+
+def decode_sequence_beam_batched(input_text, task_token, beam_width=3):
+    return decode_sequences_beam_batched([input_text], task_token, beam_width)[0]
 
 
 # Updated wrapper
@@ -167,14 +437,31 @@ def generate_ipa(word):
 def generate_word(ipa):
     return decode_sequence_beam_batched(ipa, ">", beam_width=10)
 
+def generate_ipa_batch(words):
+    return decode_sequences_beam_batched(words, "<", beam_width=10)
+
+def generate_word_batch(ipas):
+    return decode_sequences_beam_batched(ipas, ">", beam_width=10)
+
 
 def load_random_pokemon(file_path, n=10):
+    # Reservoir sample while streaming the file, so only n lines are ever kept
+    # in memory. Sample first, then parse (more efficient)
+    samples = []
+    seen = 0
     with open(file_path, "r", encoding="utf-8") as f:
-        # Filter out empty lines
-        lines = [line.strip() for line in f if line.strip()]
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue  # Filter out empty lines
 
-    # Sample first, then parse (more efficient)
-    samples = random.sample(lines, min(n, len(lines)))
+            if len(samples) < n:
+                samples.append(line)
+            else:
+                j = random.randrange(seen + 1)
+                if j < n:
+                    samples[j] = line
+            seen += 1
 
     pairs = []
     for line in samples:
@@ -195,18 +482,35 @@ def load_random_pokemon(file_path, n=10):
 
 samples = load_random_pokemon("pokemon.tsv", n=10)
 
-rows = []
-
-for word, true_ipa in samples:
-    try:
-        print("Processing", word, "...")
-        model_ipa = generate_ipa(word)
-        model_word = generate_word(true_ipa)
-        round_robin = generate_word(model_ipa)
-
-        rows.append([word, f"{true_ipa}", f"{model_ipa}", model_word, round_robin])
-    except Exception as e:
-        rows.append([word, f"Error: {e}", "", "", ""])
+words = [word for word, _ in samples]
+true_ipas = [true_ipa for _, true_ipa in samples]
+
+# Run every word through the encoder/decoder together, rather than one at a
+# time: one batch for WORD→IPA, then one batch for both IPA→WORD columns.
+print("Processing", len(samples), "words ...")
+try:
+    model_ipas = generate_ipa_batch(words)
+    reverse = generate_word_batch(true_ipas + model_ipas)
+    model_words, round_robins = reverse[:len(samples)], reverse[len(samples):]
+
+    rows = [
+        [word, f"{true_ipa}", f"{model_ipa}", model_word, round_robin]
+        for word, true_ipa, model_ipa, model_word, round_robin
+        in zip(words, true_ipas, model_ipas, model_words, round_robins)
+    ]
+except Exception:
+    # Something in the batch failed: redo the words one at a time, so only
+    # the rows that actually fail report an error
+    rows = []
+    for word, true_ipa in samples:
+        try:
+            model_ipa = generate_ipa(word)
+            model_word = generate_word(true_ipa)
+            round_robin = generate_word(model_ipa)
+
+            rows.append([word, f"{true_ipa}", f"{model_ipa}", model_word, round_robin])
+        except Exception as e:
+            rows.append([word, f"Error: {e}", "", "", ""])
 
 # Print table nicely
 headers = ["POKEMON", "TRUE IPA", "WORD→IPA", "IPA→WORD", "ROUND-TRIP"]
@@ -27,9 +27,9 @@ class ManualLayerNorm(nn.Module):
         self.eps = eps
 
     def forward(self, x):
-        mean = x.mean(dim=-1, keepdim=True)
-        var = ((x - mean) ** 2).mean(dim=-1, keepdim=True)
-        x_norm = (x - mean) / torch.sqrt(var + self.eps)
+        # One fused reduction for both statistics (biased variance, like LayerNorm)
+        var, mean = torch.var_mean(x, dim=-1, keepdim=True, unbiased=False)
+        x_norm = (x - mean) * torch.rsqrt(var + self.eps)
         if self.weight is not None:
             x_norm = x_norm * self.weight
         if self.bias is not None:
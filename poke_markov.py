@@ -2,8 +2,77 @@ import json
 import os
 import random
 
-from collections import Counter
-from collections import defaultdict
+import numpy as np
+
+from tsv_io import read_tsv_columns
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional; without it the sampling kernel runs as plain Python
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+# Attempts generate() makes before giving up on reaching min_length
+MAX_RETRIES = 1000
+
+# Largest state space (num_chars ** order) given a dense state key -> row
+# table: 4M int64 entries, 32 MB. Bigger spaces (order >= 4 or so with ~50
+# chars) use a dict of the states actually seen instead.
+MAX_DENSE_STATES = 1 << 22
+
+
+class _SparseStateRows(dict):
+    """State key -> row for state spaces too big for a dense table."""
+
+    def __missing__(self, key):
+        return -1  # Like the dense table: no weighted model knows this state
+
+
+@njit(cache=True)
+def _generate_ids(cdf, state_rows, start_key, end_id,
+                  num_chars, state_space, min_length, max_length):
+    """One generation attempt over integer states.
+
+    Returns the sampled char IDs and whether the attempt is usable; END before
+    min_length means the caller has to start over. Only uses indexing and
+    arithmetic, so it also runs (on lists, or a _SparseStateRows) as plain
+    Python.
+    """
+    ids = np.empty(max_length, dtype=np.int64)
+    length = 0
+    state = start_key
+    while length < max_length:
+        row = state_rows[state]
+        if row < 0:
+            break  # No weighted model knows this state
+
+        # Binary search for the first CDF entry above the draw
+        row_cdf = cdf[row]
+        draw = random.random()
+        lo, hi = 0, len(row_cdf)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if row_cdf[mid] <= draw:
+                lo = mid + 1
+            else:
+                hi = mid
+        next_id = lo
+
+        if next_id == end_id:
+            if length >= min_length:
+                break
+            return ids[:0], False
+
+        ids[length] = next_id
+        length += 1
+        # Shift the oldest char out of the key and the new one in
+        state = (state * num_chars + next_id) % state_space
+    return ids[:length], True
 
 
 class MultiMarkovModel:
@@ -13,52 +82,158 @@ class MultiMarkovModel:
         self.default_weights = default_weights or {}
         self.START_TOKEN = "<START>"
         self.END_TOKEN = "<END>"
+        # Dense sampling tables over an integer alphabet, rebuilt by train/load:
+        # _alphabet (id -> char), _state_rows (integer state key -> row),
+        # _probs (name -> (num_states, num_chars) probabilities) and
+        # _fused_cache (weights -> (cdf table, state key -> row lookup)).
+        self._build_tables()
 
     def train(self, model_name, data_list):
         if model_name not in self.models:
-            self.models[model_name] = defaultdict(Counter)
+            # Plain dicts: {state: {next_char: count}}, read far more than written
+            self.models[model_name] = {}
 
         print(f"Training '{model_name}' on {len(data_list)} items...")
 
-        for item in data_list:
-            padded = [self.START_TOKEN] * self.order + \
-                list(item) + [self.END_TOKEN]
-            for i in range(len(padded) - self.order):
-                state = tuple(padded[i: i + self.order])
-                next_char = padded[i + self.order]
-                self.models[model_name][state][next_char] += 1
-
-    def _get_fused_probabilities(self, state, weights):
-        # ... [Unchanged from previous version] ...
-        active_models = {}
-        for name, weight in weights.items():
-            if name in self.models and weight > 0:
-                counter = self.models[name].get(state, Counter())
-                total = sum(counter.values())
-                if total > 0:
-                    active_models[name] = {
-                        "counter": counter, "total": total, "weight": weight}
-
-        if not active_models:
-            return [], []
-
-        total_active_weight = sum(m["weight"] for m in active_models.values())
-        all_chars = set()
-        for m in active_models.values():
-            all_chars.update(m["counter"].keys())
-
-        population = []
-        probabilities = []
-        for char in all_chars:
-            fused_p = 0.0
-            for name, m in active_models.items():
-                normalized_w = m["weight"] / total_active_weight
-                p_char = m["counter"][char] / m["total"]
-                fused_p += normalized_w * p_char
-            population.append(char)
-            probabilities.append(fused_p)
-
-        return population, probabilities
+        if data_list:
+            self._count_ngrams(model_name, data_list)
+
+        self._build_tables()
+
+    def _count_ngrams(self, model_name, data_list):
+        """Counts every (state, next char) pair of the padded items in one pass."""
+        lengths = np.fromiter(map(len, data_list), dtype=np.int64, count=len(data_list))
+        codepoints = np.frombuffer(
+            "".join(data_list).encode("utf-32-le"), dtype=np.uint32)
+        chars, char_ids = np.unique(codepoints, return_inverse=True)
+        start_id, end_id = len(chars), len(chars) + 1
+
+        # Lay the items out back to back as START * order + chars + END
+        padded_lengths = lengths + self.order + 1
+        item_ends = np.cumsum(padded_lengths)
+        ids = np.full(item_ends[-1], start_id, dtype=np.int64)
+        ids[item_ends - 1] = end_id
+        char_offsets = item_ends - padded_lengths + self.order - (np.cumsum(lengths) - lengths)
+        ids[np.arange(len(codepoints)) + np.repeat(char_offsets, lengths)] = char_ids
+
+        windows = np.lib.stride_tricks.sliding_window_view(ids, self.order + 1)
+        # Windows straddling two items end in the next item's START padding
+        windows = windows[windows[:, -1] != start_id]
+
+        # Pack each (order + 1)-gram into one integer so np.unique sorts a
+        # flat array instead of comparing rows
+        base = len(chars) + 2
+        ngram_keys, counts = np.unique(
+            windows @ base ** np.arange(self.order, -1, -1, dtype=np.int64),
+            return_counts=True)
+        ngrams = ngram_keys[:, None] // base ** np.arange(
+            self.order, -1, -1, dtype=np.int64) % base
+
+        tokens = [chr(c) for c in chars.tolist()] + [self.START_TOKEN, self.END_TOKEN]
+        transitions = self.models[model_name]
+        for ngram, count in zip(ngrams.tolist(), counts.tolist()):
+            state = tuple(tokens[i] for i in ngram[:-1])
+            next_counts = transitions.setdefault(state, {})
+            next_char = tokens[ngram[-1]]
+            next_counts[next_char] = next_counts.get(next_char, 0) + count
+
+    def _build_tables(self):
+        """Lays every model out as a (state x char) probability matrix."""
+        chars = {self.START_TOKEN}
+        for transitions in self.models.values():
+            for state, counter in transitions.items():
+                chars.update(state)
+                chars.update(counter)
+
+        self._alphabet = tuple(sorted(chars))
+        char_ids = {char: i for i, char in enumerate(self._alphabet)}
+        num_chars = len(self._alphabet)
+
+        # A state is keyed by its char IDs read as a base-num_chars number, so
+        # generation can roll the key forward arithmetically instead of
+        # building and hashing a tuple of strings every step.
+        def state_key(state):
+            key = 0
+            for char in state:
+                key = key * num_chars + char_ids[char]
+            return key
+
+        states = {}
+        for transitions in self.models.values():
+            for state in transitions:
+                states.setdefault(state, len(states))
+        self._state_rows = {state_key(state): row for state, row in states.items()}
+        self._start_key = state_key([self.START_TOKEN] * self.order)
+        self._end_id = char_ids.get(self.END_TOKEN)
+
+        self._probs = {}
+        for name, transitions in self.models.items():
+            counts = np.zeros((len(states), len(char_ids)), dtype=np.float32)
+            for state, counter in transitions.items():
+                row = states[state]
+                for char, count in counter.items():
+                    counts[row, char_ids[char]] = count
+            totals = counts.sum(axis=1, keepdims=True)
+            self._probs[name] = np.divide(
+                counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+        self._fused_cache = {}
+
+    def _get_fused_cdfs(self, weights, as_lists=False):
+        """Per-state CDFs of the weighted mixture of models, cached per weights.
+
+        Each state renormalizes over the models that actually know it, so
+        fusion is one weighted sum of the probability matrices. The state
+        lookup is a dense array (or list) up to MAX_DENSE_STATES keys and a
+        _SparseStateRows dict beyond that.
+        """
+        weight_items = tuple(sorted(
+            (name, weight) for name, weight in weights.items()
+            if name in self._probs and weight > 0))
+        key = (weight_items, as_lists)
+        if key not in self._fused_cache:
+            num_states, num_chars = len(self._state_rows), len(self._alphabet)
+            fused = np.zeros((num_states, num_chars), dtype=np.float64)
+            active_weight = np.zeros(num_states, dtype=np.float64)
+            for name, weight in weight_items:
+                probs = self._probs[name]
+                fused += weight * probs
+                active_weight += weight * (probs.sum(axis=1) > 0)
+
+            known = active_weight > 0
+            cdf = np.cumsum(fused, axis=1)
+            # Normalizing by the last column keeps every draw in range
+            cdf[known] /= cdf[known, -1:]
+
+            # Flat state key -> row lookup, -1 where these weights know nothing
+            state_space = self._state_space()
+            state_keys = np.fromiter(
+                self._state_rows.keys(), dtype=np.int64, count=num_states)
+            rows = np.fromiter(
+                self._state_rows.values(), dtype=np.int64, count=num_states)
+            if state_space <= MAX_DENSE_STATES:
+                state_rows = np.full(state_space, -1, dtype=np.int64)
+                state_rows[state_keys] = np.where(known[rows], rows, -1)
+            else:
+                state_rows = _SparseStateRows(
+                    zip(state_keys[known[rows]].tolist(), rows[known[rows]].tolist()))
+
+            if as_lists:
+                # The interpreter indexes lists much faster than arrays
+                cdf = cdf.tolist()
+                if isinstance(state_rows, np.ndarray):
+                    state_rows = state_rows.tolist()
+            self._fused_cache[key] = (cdf, state_rows)
+        return self._fused_cache[key]
+
+    def _state_space(self):
+        """Number of possible integer state keys, num_chars ** order."""
+        num_chars = len(self._alphabet)
+        # Keys are rolled forward as state * num_chars + char in int64
+        if num_chars ** (self.order + 1) >= 2 ** 63:
+            raise ValueError(
+                f"order={self.order} over {num_chars} chars overflows int64 state keys.")
+        return num_chars ** self.order
 
     def generate(self, weights=None, min_length=4, max_length=12):
         """Generates strings. Falls back to default_weights if none provided."""
@@ -67,27 +242,87 @@ class MultiMarkovModel:
             raise ValueError(
                 "Must provide weights or set default_weights during init.")
 
-        current_state = tuple([self.START_TOKEN] * self.order)
-        generated_chars = []
+        # numba can't take a dict, so sparse tables use the plain Python kernel
+        state_space = self._state_space()
+        dense = state_space <= MAX_DENSE_STATES
+        generate_ids = _generate_ids
+        if not dense:
+            generate_ids = getattr(_generate_ids, "py_func", _generate_ids)
+
+        cdf, state_rows = self._get_fused_cdfs(
+            weights, as_lists=not (HAVE_NUMBA and dense))
+        num_chars = len(self._alphabet)
+        end_id = -1 if self._end_id is None else self._end_id
+
+        for _attempt in range(MAX_RETRIES):
+            ids, usable = generate_ids(
+                cdf, state_rows, self._start_key, end_id,
+                num_chars, state_space, min_length, max_length)
+            if usable:
+                return "".join(self._alphabet[i] for i in ids.tolist())
+
+        raise RuntimeError(
+            f"No string of at least {min_length} chars in {MAX_RETRIES} attempts.")
+
+    def generate_batch(self, n, weights=None, min_length=4, max_length=12):
+        """Generates n strings at once, stepping every chain in lockstep."""
+        weights = weights or self.default_weights
+        if not weights:
+            raise ValueError(
+                "Must provide weights or set default_weights during init.")
 
-        while len(generated_chars) < max_length:
-            population, probs = self._get_fused_probabilities(
-                current_state, weights)
-            if not population:
+        cdf, state_rows = self._get_fused_cdfs(weights)
+        num_chars = len(self._alphabet)
+        state_space = self._state_space()
+        end_id = -1 if self._end_id is None else self._end_id
+
+        if isinstance(state_rows, np.ndarray):
+            lookup_rows = state_rows.__getitem__
+        else:
+            def lookup_rows(keys):
+                return np.fromiter(
+                    map(state_rows.__getitem__, keys.tolist()), dtype=np.int64, count=len(keys))
+
+        results = []
+        for _round in range(MAX_RETRIES):
+            if len(results) >= n:
                 break
+            # Chains that hit END before min_length are redrawn in the next round
+            pending = n - len(results)
+            ids = np.zeros((pending, max_length), dtype=np.int64)
+            lengths = np.zeros(pending, dtype=np.int64)
+            states = np.full(pending, self._start_key, dtype=np.int64)
+            usable = np.ones(pending, dtype=bool)
+            active = np.arange(pending)
+
+            for step in range(max_length):
+                # Chains in a state no weighted model knows just stop
+                rows = lookup_rows(states[active])
+                active, rows = active[rows >= 0], rows[rows >= 0]
+                if len(active) == 0:
+                    break
 
-            next_char = random.choices(population, weights=probs, k=1)[0]
+                # Row-wise searchsorted: count the CDF entries at or below each draw
+                draws = np.random.random(len(active))
+                next_ids = (cdf[rows] <= draws[:, None]).sum(axis=1)
 
-            if next_char == self.END_TOKEN:
-                if len(generated_chars) >= min_length:
-                    break
-                else:
-                    return self.generate(weights, min_length, max_length)
+                ended = next_ids == end_id
+                usable[active[ended]] = step >= min_length
+                active, next_ids = active[~ended], next_ids[~ended]
 
-            generated_chars.append(next_char)
-            current_state = tuple(list(current_state[1:]) + [next_char])
+                ids[active, step] = next_ids
+                lengths[active] = step + 1
+                states[active] = (states[active] * num_chars + next_ids) % state_space
 
-        return "".join(generated_chars)
+            results.extend(
+                "".join(self._alphabet[i] for i in row[:length])
+                for row, length in zip(ids[usable].tolist(), lengths[usable].tolist()))
+
+        if len(results) < n:
+            # Every round gave each missing string another attempt, as generate does
+            raise RuntimeError(
+                f"No string of at least {min_length} chars in {MAX_RETRIES} attempts.")
+        return results
 
     def export_to_json(self, filepath):
         """Exports models and default weights to JSON."""
@@ -103,7 +338,8 @@ class MultiMarkovModel:
             }
 
         with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
+            # Compact separators: no indentation whitespace in very large files
+            json.dump(export_data, f, ensure_ascii=False, separators=(",", ":"))
         print(f"Exported multi-model to {filepath}")
 
     @classmethod
@@ -114,10 +350,69 @@ class MultiMarkovModel:
         model = cls(order=data["order"],
                     default_weights=data.get("default_weights", {}))
         for name, saved_dict in data["models"].items():
-            model.models[name] = defaultdict(Counter)
-            for state_str, counts in saved_dict.items():
-                state_tuple = tuple(json.loads(state_str))
-                model.models[name][state_tuple] = Counter(counts)
+            model.models[name] = {
+                tuple(json.loads(state_str)): counts
+                for state_str, counts in saved_dict.items()}
+        model._build_tables()
+        return model
+
+    def export_to_npz(self, filepath):
+        """Exports models and default weights as flat integer arrays.
+
+        Every (model, state, next char, count) entry becomes one row of the
+        parallel model_ids / states / next_ids / counts arrays, with chars
+        stored as indices into `vocab`. Much smaller and faster to load than
+        the JSON export, which the JS side still reads.
+        """
+        char_ids = {char: i for i, char in enumerate(self._alphabet)}
+        model_ids, states, next_ids, counts = [], [], [], []
+        for model_id, transitions in enumerate(self.models.values()):
+            for state, counter in transitions.items():
+                state_ids = [char_ids[char] for char in state]
+                for char, count in counter.items():
+                    model_ids.append(model_id)
+                    states.append(state_ids)
+                    next_ids.append(char_ids[char])
+                    counts.append(count)
+
+        np.savez_compressed(
+            filepath,
+            order=self.order,
+            vocab=np.array(self._alphabet, dtype=str),
+            model_names=np.array(list(self.models), dtype=str),
+            weight_names=np.array(list(self.default_weights), dtype=str),
+            weight_values=np.array(list(self.default_weights.values()), dtype=np.float64),
+            model_ids=np.array(model_ids, dtype=np.int32),
+            states=np.array(states, dtype=np.int32).reshape(-1, self.order),
+            next_ids=np.array(next_ids, dtype=np.int32),
+            counts=np.array(counts, dtype=np.int64))
+        print(f"Exported multi-model to {filepath}")
+
+    @classmethod
+    def load_from_npz(cls, filepath):
+        with np.load(filepath) as data:
+            vocab = data["vocab"].tolist()
+            model = cls(order=int(data["order"]),
+                        default_weights=dict(zip(data["weight_names"].tolist(),
+                                                 data["weight_values"].tolist())))
+            transitions = [model.models.setdefault(name, {})
+                           for name in data["model_names"].tolist()]
+            model_ids, states = data["model_ids"], data["states"]
+            next_chars = [vocab[i] for i in data["next_ids"].tolist()]
+            counts = data["counts"].tolist()
+
+        # export_to_npz writes each state's entries contiguously, so build one
+        # {next_char: count} dict per run of identical (model, state) rows
+        keys = np.column_stack([model_ids, states])
+        changed = np.any(keys[1:] != keys[:-1], axis=1)
+        starts = np.flatnonzero(np.r_[len(keys) > 0, changed])
+        ends = np.r_[starts[1:], len(keys)]
+        for start, end, model_id, state in zip(
+                starts.tolist(), ends.tolist(),
+                model_ids[starts].tolist(), states[starts].tolist()):
+            transitions[model_id][tuple(vocab[i] for i in state)] = dict(
+                zip(next_chars[start:end], counts[start:end]))
+        model._build_tables()
         return model
 
 
@@ -130,23 +425,13 @@ def load_data_from_tsv(tsv_path):
         print(f"Warning: {tsv_path} not found.")
         return words, ipas
 
-    with open(tsv_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            parts = line.strip().split('\t')
-            if len(parts) != 2:
-                continue
-
-            word = parts[0].lower().strip()
-            ipa_field = parts[1]
-
-            # Handle multiple pronunciations separated by commas
-            ipa_variants = ipa_field.split(',')
-
-            for ipa_raw in ipa_variants:
-                ipa = ipa_raw.replace("/", "").replace(" ", "").strip()
-                if ipa:
-                    words.append(word)
-                    ipas.append(ipa)
+    # Handle multiple pronunciations separated by commas
+    for word, ipa_field in zip(*read_tsv_columns(tsv_path)):
+        for ipa in ipa_field.split(','):
+            ipa = ipa.strip()
+            if ipa:
+                words.append(word)
+                ipas.append(ipa)
 
     return words, ipas
 
@@ -184,9 +469,9 @@ if __name__ == "__main__":
 
     # 7. Generate using the embedded default_weights
     print("\n--- Generating IPA (Phonemes) ---")
-    for _ in range(3):
-        print(f"/{phoneme_model.generate()}/")
+    for ipa in phoneme_model.generate_batch(3):
+        print(f"/{ipa}/")
 
     print("\n--- Generating Words (Graphemes) ---")
-    for _ in range(3):
-        print(grapheme_model.generate())
+    for word in grapheme_model.generate_batch(3):
+        print(word)
@@ -3,10 +3,14 @@ import os
 os.environ["KERAS_BACKEND"] = "tensorflow"
 
 import keras
+import tensorflow as tf
 from keras import layers
 import json
 import numpy as np
 
+from transformer_layers import PositionalEmbedding, ReversibleEmbedding
+from tsv_io import read_tsv_columns
+
 # 1. DYNAMIC VOCABULARY BUILDER
 
 
@@ -19,24 +23,12 @@ def build_vocab_from_files(file_paths):
         if not os.path.exists(fpath):
             continue
 
-        with open(fpath, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split('\t')
-                if len(parts) != 2:
-                    continue
-
-                word_raw = parts[0]
-                ipa_field = parts[1]
-
-                # Handle comma-separated variants
-                ipa_variants = ipa_field.split(',')
-
-                word = word_raw.lower().strip()
-                unique_chars.update(list(word))
+        words, ipa_fields = read_tsv_columns(fpath)
+        unique_chars.update("".join(words))
 
-                for ipa_var in ipa_variants:
-                    ipa_clean = ipa_var.replace("/", "").replace(" ", "").strip()
-                    unique_chars.update(list(ipa_clean))
+        # Handle comma-separated variants
+        ipa_variants = ",".join(ipa_fields).split(",")
+        unique_chars.update("".join(map(str.strip, ipa_variants)))
 
     # --- THE FIX IS HERE ---
     # Ensure [PAD] is NOT in the set we are about to enumerate.
@@ -65,69 +57,172 @@ def build_vocab_from_files(file_paths):
 
 
 
-def encode(text, vocab, max_len):
-    ids = [vocab.get(c, vocab["[PAD]"]) for c in text]  # Use .get() to be safe
-    ids = ids[:max_len]
-    return ids + [0] * (max_len - len(ids))
+def build_char_lut(vocab):
+    """Codepoint -> token ID table, so whole batches encode with one gather."""
+    max_codepoint = max(ord(c) for c in vocab if len(c) == 1) + 1
+    char_lut = np.full(max_codepoint, vocab["[PAD]"], dtype=np.int32)
+    for char, idx in vocab.items():
+        if len(char) == 1:
+            char_lut[ord(char)] = idx
+    return char_lut
+
+
+def encode_batch(texts, char_lut, out):
+    """
+    Encodes every text to token IDs at once, written into the preallocated
+    (len(texts), max_len) array `out`. Texts are cut off at max_len and
+    padded with PAD, and unknown characters become PAD.
+    """
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codepoints = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    known = codepoints < len(char_lut)
+    ids = np.where(known, char_lut[codepoints * known], char_lut[0])
+
+    # Row and column of every character in the output grid
+    rows = np.repeat(np.arange(len(texts)), lengths)
+    cols = np.arange(len(codepoints)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    keep = cols < out.shape[1]
+
+    out[:] = 0
+    out[rows[keep], cols[keep]] = ids[keep]
+    return out
 
 # 2. DATA LOADING (Consolidated)
 
 
 def prepare_multitask_data(file_paths, vocab, max_len):
-    encoder_inputs, decoder_inputs, decoder_targets = [], [], []
+    # Collect the (source, target) text pairs first, so the ID arrays can be
+    # allocated once at their final size and filled in a single pass.
+    sources, targets = [], []
+    # The dictionaries overlap heavily (filtered/unfiltered copies, US/UK), so
+    # each (word, ipa) pair is only kept the first time it is seen
+    seen_pairs = set()
 
     print("Processing data...")
     for fpath in file_paths:
         if not os.path.exists(fpath):
             continue
 
-        with open(fpath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        for line in lines:
-            parts = line.strip().split('\t')
-            if len(parts) != 2:
-                continue
-
-            word = parts[0].lower().strip()
-            ipa_field = parts[1]
-
+        words, ipa_fields = read_tsv_columns(fpath)
+        for word, ipa_field in zip(words, ipa_fields):
             # 1. SPLIT by comma to handle multiple pronunciations
             # "ˈɛrənsən, ˈɑːrənsən" -> ["ˈɛrənsən", " ˈɑːrənsən"]
-            ipa_variants = ipa_field.split(',')
-
             # 2. Iterate over each variant and create a training pair
-            for ipa_raw in ipa_variants:
-                ipa = ipa_raw.replace("/", "").replace(" ", "").strip()
+            for ipa in ipa_field.split(','):
+                ipa = ipa.strip()
 
-                # Skip empty strings (in case of trailing commas)
-                if not ipa:
+                # Skip empty strings (in case of trailing commas) and repeats
+                if not ipa or (word, ipa) in seen_pairs:
                     continue
+                seen_pairs.add((word, ipa))
 
                 # DIRECTION 1: English -> IPA
-                src_g2p = f"<{word}"
-                tgt_g2p = f"[{ipa}]"
-
                 # DIRECTION 2: IPA -> English
                 # (Both IPA variants map back to the same English word)
-                src_p2g = f">{ipa}"
-                tgt_p2g = f"[{word}]"
-
-                for src, tgt in [(src_g2p, tgt_g2p), (src_p2g, tgt_p2g)]:
-                    e_idx = encode(src, vocab, max_len)
-                    t_idx = encode(tgt, vocab, max_len)
-
-                    encoder_inputs.append(e_idx)
-                    decoder_inputs.append(t_idx[:-1])
-                    decoder_targets.append(t_idx[1:])
-
-    return (np.array(encoder_inputs), np.array(decoder_inputs)), np.array(decoder_targets)
+                sources += [f"<{word}", f">{ipa}"]
+                targets += [f"[{ipa}]", f"[{word}]"]
+
+    print(f"  {len(seen_pairs)} unique (word, IPA) pairs")
+
+    char_lut = build_char_lut(vocab)
+    encoder_inputs = encode_batch(
+        sources, char_lut, np.empty((len(sources), max_len), dtype=np.int32))
+    target_ids = encode_batch(
+        targets, char_lut, np.empty((len(targets), max_len), dtype=np.int32))
+
+    # Teacher forcing: the decoder sees the target shifted right by one
+    return (encoder_inputs, target_ids[:, :-1]), target_ids[:, 1:]
+
+
+def _unpadded_length(ids):
+    """Position just past the last non-PAD token of a 1-D ID sequence."""
+    positions = tf.range(1, tf.shape(ids)[0] + 1)
+    return tf.reduce_max(tf.where(ids != 0, positions, 0))
+
+
+def _bucketed_batch_count(inputs, targets, batch_size, bucket_widths):
+    """
+    Number of batches make_dataset's bucketing yields: every bucket is cut
+    into full batches plus one partial batch, whatever order rows arrive in.
+    """
+    lengths = np.zeros(len(targets), dtype=np.int64)
+    for ids in (*inputs, targets):
+        nonzero = ids != 0
+        unpadded = ids.shape[1] - np.argmax(nonzero[:, ::-1], axis=1)
+        lengths = np.maximum(lengths, np.where(nonzero.any(axis=1), unpadded, 0))
+    rows_per_bucket = np.bincount(
+        np.searchsorted(bucket_widths, lengths), minlength=len(bucket_widths))
+    return int(np.sum(-(-rows_per_bucket // batch_size)))
+
+
+def make_dataset(inputs, targets, batch_size, shuffle=False, bucket_widths=None):
+    """
+    Wraps the encoded arrays in a batched, prefetching tf.data pipeline.
+
+    With shuffle, every epoch visits the rows in a fresh order drawn from
+    the whole dataset. (The arrays hold each TSV's rows together, so a
+    partial shuffle buffer would still feed the files through in order.)
+
+    With bucket_widths (ascending, the last covering the full padded length)
+    rows are batched with others of a similar unpadded length, and each batch
+    is cut down to its bucket's width, so short words don't pay attention
+    over MAX_SEQ positions. A fixed set of widths keeps the number of distinct
+    batch shapes (and XLA compilations) small. The bucketed dataset still
+    reports its exact length, so Keras knows where each epoch ends.
+    """
+    if bucket_widths:
+        num_batches = _bucketed_batch_count(inputs, targets, batch_size, bucket_widths)
+
+    if shuffle:
+        # Shuffle row indices rather than the rows themselves, so a buffer
+        # spanning the full dataset costs 8 bytes per row, not a copy of it.
+        # Rows are gathered a block of indices at a time, then unbatched.
+        inputs = tuple(tf.constant(a) for a in inputs)
+        targets = tf.constant(targets)
+        num_rows = int(targets.shape[0])
+        ds = tf.data.Dataset.range(num_rows).shuffle(
+            num_rows, reshuffle_each_iteration=True).batch(1024)
+        ds = ds.map(
+            lambda i: (tuple(tf.gather(a, i) for a in inputs), tf.gather(targets, i)),
+            num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+    else:
+        ds = tf.data.Dataset.from_tensor_slices((inputs, targets))
+
+    # Batch order only matters up to the shuffle, so let parallel stages
+    # hand elements on as soon as they are ready
+    options = tf.data.Options()
+    options.deterministic = False
+    ds = ds.with_options(options)
+
+    if not bucket_widths:
+        return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    widths = tf.constant(bucket_widths, dtype=tf.int32)
+
+    def bucket_of(x, y):
+        length = tf.reduce_max(
+            [_unpadded_length(x[0]), _unpadded_length(x[1]), _unpadded_length(y)])
+        return tf.cast(tf.searchsorted(widths, length[None])[0], tf.int64)
+
+    def batch_bucket(bucket, rows):
+        width = widths[bucket]
+        return rows.batch(batch_size).map(
+            lambda x, y: ((x[0][:, :width], x[1][:, :width]), y[:, :width]))
+
+    ds = ds.group_by_window(bucket_of, batch_bucket, window_size=batch_size)
+    # group_by_window leaves the length unknown, which makes Keras warn that
+    # the input ran out of data at the end of every epoch
+    ds = ds.apply(tf.data.experimental.assert_cardinality(num_batches))
+    return ds.prefetch(tf.data.AUTOTUNE)
 
 
 # 4. THE TRANSFORMER ARCHITECTURE
 
 
 def transformer_block(x, embed_dim, num_heads, ff_dim, rate=0.1):
+    # Attention dropout is left at 0 (dropout is applied to the output
+    # instead): with it, Keras can't route MultiHeadAttention through the
+    # fused ops.dot_product_attention kernel.
     attn_output = layers.MultiHeadAttention(
         num_heads=num_heads, key_dim=embed_dim)(x, x)
     attn_output = layers.Dropout(rate)(attn_output)
@@ -141,30 +236,24 @@ def transformer_block(x, embed_dim, num_heads, ff_dim, rate=0.1):
 
 def build_transformer(vocab_size, max_len, embed_dim=128, num_heads=4, ff_dim=128, rate=0.1):
     # --- ENCODER ---
-    enc_in = keras.Input(shape=(max_len,), name="enc_in")
+    # Sequence lengths are left open so batches can be cut to their bucket's
+    # width; max_len only sizes the position table
+    enc_in = keras.Input(shape=(None,), name="enc_in")
 
-    # Embeddings (Masking enabled)
-    token_emb = layers.Embedding(vocab_size, embed_dim, mask_zero=True)(enc_in)
-    pos_emb_enc = layers.Embedding(max_len, embed_dim)
-    positions_enc = keras.ops.arange(0, max_len, dtype="int32")
-    pos_emb = pos_emb_enc(positions_enc)
-    pos_emb = keras.ops.expand_dims(pos_emb, axis=0)
+    # Embeddings (Masking enabled). One token table serves the encoder, the
+    # decoder and (in reverse) the output projection; one position table
+    # serves both the encoder and the decoder.
+    token_emb_layer = ReversibleEmbedding(vocab_size, embed_dim, mask_zero=True)
+    pos_emb_layer = PositionalEmbedding(max_len)
 
-    x = token_emb + pos_emb
+    x = pos_emb_layer(token_emb_layer(enc_in))
     x = transformer_block(x, embed_dim, num_heads, ff_dim, rate)
     enc_out = x
 
     # --- DECODER ---
-    dec_in = keras.Input(shape=(max_len-1,), name="dec_in")
+    dec_in = keras.Input(shape=(None,), name="dec_in")
 
-    token_emb_dec = layers.Embedding(
-        vocab_size, embed_dim, mask_zero=True)(dec_in)
-    pos_emb_dec_layer = layers.Embedding(max_len - 1, embed_dim)
-    positions_dec = keras.ops.arange(0, max_len - 1, dtype="int32")
-    pos_emb_dec = pos_emb_dec_layer(positions_dec)
-    pos_emb_dec = keras.ops.expand_dims(pos_emb_dec, axis=0)
-
-    y = token_emb_dec + pos_emb_dec
+    y = pos_emb_layer(token_emb_layer(dec_in))
 
     # 1. Self-Attention (Causal)
     attn_output = layers.MultiHeadAttention(num_heads=num_heads, key_dim=embed_dim)(
@@ -184,9 +273,12 @@ def build_transformer(vocab_size, max_len, embed_dim=128, num_heads=4, ff_dim=12
     ffn_output = layers.Dropout(rate)(ffn_output)  # Added Dropout
     y = layers.LayerNormalization(epsilon=1e-6)(y + ffn_output)
 
-    outputs = layers.Dense(vocab_size, activation="softmax")(y)
+    # Tied output projection, computed in float32 even under mixed precision.
+    # The model returns logits: the loss applies the softmax itself, and
+    # inference/export add one via with_softmax()
+    logits = token_emb_layer(y, reverse=True)
 
-    return keras.Model([enc_in, dec_in], outputs)
+    return keras.Model([enc_in, dec_in], logits)
 
 
 # 5. EXECUTION
@@ -204,6 +296,17 @@ FILES = [
     "pokemon.tsv",
 ]
 MAX_SEQ = 40
+BATCH_SIZE = 64
+# Most words are far shorter than MAX_SEQ; batch them at these padded lengths
+BUCKET_WIDTHS = [8, 12, 16, 24, MAX_SEQ]
+VALIDATION_SPLIT = 0.1
+
+# Mixed precision halves activation traffic on tensor-core GPUs. CPU support
+# for bfloat16 math varies, so CPU runs stay in float32. The final vocabulary
+# projection stays in float32 either way: casting bfloat16 logits up inside
+# the loss would not recover the precision the matmul already rounded away.
+if tf.config.list_physical_devices("GPU"):
+    keras.mixed_precision.set_global_policy("mixed_bfloat16")
 
 # Build vocab
 vocab, inv_vocab = build_vocab_from_files(FILES)
@@ -213,9 +316,28 @@ with open("vocab.json", "w") as f:
 
 (x_enc, x_dec), y_tgt = prepare_multitask_data(FILES, vocab, max_len=MAX_SEQ)
 
+# Hold out the tail for validation, as validation_split did
+num_train = int(len(y_tgt) * (1 - VALIDATION_SPLIT))
+train_ds = make_dataset(
+    (x_enc[:num_train], x_dec[:num_train]), y_tgt[:num_train], BATCH_SIZE,
+    shuffle=True, bucket_widths=BUCKET_WIDTHS)
+val_ds = make_dataset(
+    (x_enc[num_train:], x_dec[num_train:]), y_tgt[num_train:], BATCH_SIZE,
+    bucket_widths=BUCKET_WIDTHS)
+
 model = build_transformer(len(vocab), MAX_SEQ)
+# "auto" compiles the train step with XLA on GPUs only. Forcing XLA on CPU
+# made the first epoch much slower to compile (57s vs 14s) and later epochs
+# no faster (~9s either way). On GPU the bucket widths bound how many shapes
+# XLA compiles.
+# steps_per_execution runs 32 steps per call into the compiled function, so
+# the small per-step work isn't dwarfed by Python dispatch. Keras handles a
+# shorter final call, so the epoch's batch count needn't be a multiple of 32.
 model.compile(optimizer="adam",
-              loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+              loss=keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+              metrics=["accuracy"],
+              jit_compile="auto",
+              steps_per_execution=32)
 
 callbacks = [
     # 1. Stop if validation loss doesn't improve for 2 epochs
@@ -233,10 +355,9 @@ callbacks = [
     )
 ]
 
-model.fit([x_enc, x_dec], y_tgt,
-          batch_size=64,
+model.fit(train_ds,
           epochs=30,
-          validation_split=0.1,
+          validation_data=val_ds,
           callbacks=callbacks)
 
 model.save("poke_model_final.keras")
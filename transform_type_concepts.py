@@ -2,45 +2,24 @@ import yaml
 import os
 import glob
 import json
+import numpy as np
 import torch
 import clip
+from concurrent.futures import ThreadPoolExecutor
 
+from tsv_io import load_ipa_dictionaries
 
-def load_ipa_dictionaries(tsv_paths):
-    """
-    Loads multiple TSVs into a single fast lookup dictionary.
-    Files are processed in order; the first file to define a word wins.
-    """
-    ipa_map = {}
-
-    for tsv_path in tsv_paths:
-        if not os.path.exists(tsv_path):
-            print(f"Warning: Could not find {tsv_path}. Skipping.")
-            continue
-
-        print(f"Loading dictionary from {tsv_path}...")
-        added_from_file = 0
-
-        with open(tsv_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split('\t')
-                if len(parts) >= 2:
-                    word = parts[0].lower().strip()
-
-                    # Only add if we haven't seen this word in an earlier TSV
-                    if word not in ipa_map:
-                        ipa_variants = parts[1].split(',')
-                        clean_ipa = ipa_variants[0].replace(
-                            "/", "").replace(" ", "").strip()
-
-                        if clean_ipa:
-                            ipa_map[word] = clean_ipa
-                            added_from_file += 1
+try:
+    # libyaml's C parser; the pure-Python SafeLoader gives the same result
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
-        print(f"  -> Added {added_from_file} new words from this file.")
-
-    print(f"\nFinished building dictionary. Total unique words: {len(ipa_map)}\n")
-    return ipa_map
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; without it the tree is written by the stdlib encoder
+    orjson = None
 
 
 def build_pokemon_types_tree(input_dir, ipa_map, missing_words_set):
@@ -62,37 +41,51 @@ def build_pokemon_types_tree(input_dir, ipa_map, missing_words_set):
         print(f"Warning: No .txt files found in '{input_dir}'!")
         return types_node
 
-    for filepath in txt_files:
-        filename = os.path.basename(filepath)
-        # e.g., 'water' -> 'WATER'
-        type_name = os.path.splitext(filename)[0].upper()
-
-        # Create the specific type node (e.g., __WATER)
-        type_node = {
-            "word": type_name,
-            "silent": True,
-            "unsearchable": True,
-            "pokemon_type": True,  # Added specific tag
-            "children": []
-        }
-
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                word = line.strip()
-                if not word:
-                    continue
-
-                # Pass each word through the exact same parser used by the YAML
-                child_node = parse_label(word, ipa_map, missing_words_set)
-                type_node["children"].append(child_node)
-
-        if type_node["children"]:
-            types_node["children"].append(type_node)
-            print(f"Loaded {len(type_node['children'])} concepts for type: {type_name}")
+    # The files are independent, so read them on a thread pool and parse them
+    # here as they arrive, in glob order. The parsing is pure Python under the
+    # GIL, and worker processes would each need a pickled copy of ipa_map.
+    with ThreadPoolExecutor(max_workers=min(len(txt_files), os.cpu_count() or 1)) as executor:
+        for filepath, lines in zip(txt_files, executor.map(_read_lines, txt_files)):
+            type_node = build_type_node(filepath, lines, ipa_map, missing_words_set)
+            if type_node["children"]:
+                types_node["children"].append(type_node)
+                print(f"Loaded {len(type_node['children'])} concepts for type: {type_node['word']}")
 
     return types_node
 
 
+def _read_lines(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def build_type_node(filepath, lines, ipa_map, missing_words_set):
+    """Builds the node for one type's .txt file from its lines."""
+    filename = os.path.basename(filepath)
+    # e.g., 'water' -> 'WATER'
+    type_name = os.path.splitext(filename)[0].upper()
+
+    # Create the specific type node (e.g., __WATER)
+    type_node = {
+        "word": type_name,
+        "silent": True,
+        "unsearchable": True,
+        "pokemon_type": True,  # Added specific tag
+        "children": []
+    }
+
+    for line in lines:
+        word = line.strip()
+        if not word:
+            continue
+
+        # Pass each word through the exact same parser used by the YAML
+        child_node = parse_label(word, ipa_map, missing_words_set)
+        type_node["children"].append(child_node)
+
+    return type_node
+
+
 def parse_label(label, ipa_dict, missing_words_set):
     """Parses a single YAML string into a structured JSON object."""
     parts = label.split(':')
@@ -155,52 +148,116 @@ def parse_label(label, ipa_dict, missing_words_set):
 
 
 def process_node(node, ipa_dict, missing_words_set):
-    """Recursively walks the parsed YAML data."""
-    if isinstance(node, str):
-        return parse_label(node, ipa_dict, missing_words_set)
-
-    elif isinstance(node, dict):
-        results = []
-        for key, value in node.items():
-            parsed_node = parse_label(key, ipa_dict, missing_words_set)
+    """
+    Walks the parsed YAML data with an explicit stack rather than recursion,
+    so deep trees cost no Python frames and never hit the recursion limit.
+    """
+    # Each stack entry is (yaml_node, output_list, index): the parsed node is
+    # stored at output_list[index]. Lists are preallocated so children keep
+    # their YAML order, and pushed reversed so they are visited in order too.
+    root = [None]
+    stack = [(node, root, 0)]
+    while stack:
+        node, slot, index = stack.pop()
+
+        if isinstance(node, str):
+            slot[index] = parse_label(node, ipa_dict, missing_words_set)
+
+        elif isinstance(node, dict):
+            results = []
+            pending = []
+            for key, value in node.items():
+                parsed_node = parse_label(key, ipa_dict, missing_words_set)
+
+                if isinstance(value, list):
+                    children = [None] * len(value)
+                    pending.extend((child, children, i) for i, child in enumerate(value))
+                elif value is not None:
+                    children = [None]
+                    pending.append((value, children, 0))
+                else:
+                    children = []
+
+                parsed_node["children"] = children
+                results.append(parsed_node)
+
+            stack.extend(reversed(pending))
+            slot[index] = results[0] if len(results) == 1 else results
+
+        elif isinstance(node, list):
+            items = [None] * len(node)
+            stack.extend((child, items, i) for i, child in reversed(list(enumerate(node))))
+            slot[index] = items
+
+    return root[0]
+
+
+def write_json(path, data):
+    """Writes data as indented UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
 
-            children = []
-            if isinstance(value, list):
-                for child in value:
-                    children.append(process_node(
-                        child, ipa_dict, missing_words_set))
-            elif value is not None:
-                children.append(process_node(
-                    value, ipa_dict, missing_words_set))
 
-            parsed_node["children"] = children
-            results.append(parsed_node)
+def collect_searchable(node, out):
+    """
+    Appends every searchable node in the tree under `node` to `out`, in
+    depth-first order, using an explicit stack like process_node.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
 
-        return results[0] if len(results) == 1 else results
+        # Only spend compute on words that will actually be searched!
+        if node.get("word") and not node.get("unsearchable", False):
+            out.append(node)
 
-    elif isinstance(node, list):
-        return [process_node(child, ipa_dict, missing_words_set) for child in node]
+        # Dig into the children (reversed, so they pop in order)
+        stack.extend(reversed(node.get("children", [])))
 
 
-def add_clip_embeddings(node, model, device):
+def add_clip_embeddings(node, model, device, vectors_path, batch_size=256):
     """
-    Recursively computes and attaches a 512-dimensional CLIP embedding
-    to any node that is searchable.
+    Computes a 512-dimensional CLIP embedding for every searchable node,
+    encoding the words batch_size at a time. The embeddings are written as
+    rows of a float32 .npy file at vectors_path, and each node gets the
+    index of its row as "vector_idx".
     """
-    # Only spend compute on words that will actually be searched!
-    if node.get("word") and not node.get("unsearchable", False):
-        with torch.no_grad():
-            # Tokenize and run the model
-            text_tokens = clip.tokenize([node["word"]]).to(device)
-            embedding = model.encode_text(text_tokens)
+    searchable = []
+    collect_searchable(node, searchable)
+
+    # The same word can appear under several parents (and types), so encode
+    # each distinct word once and point all of its nodes at the same row
+    nodes_by_word = {}
+    for n in searchable:
+        nodes_by_word.setdefault(n["word"], []).append(n)
+    words = list(nodes_by_word)
+
+    # Rows are written straight into the file as each batch comes back
+    vectors = np.lib.format.open_memmap(
+        vectors_path, mode='w+', dtype=np.float32,
+        shape=(len(words), model.text_projection.shape[1]))
+
+    # inference_mode also skips the autograd view/version tracking no_grad keeps
+    with torch.inference_mode():
+        for start in range(0, len(words), batch_size):
+            batch = words[start:start + batch_size]
+
+            # Tokenize and run the model; encode_text pools each row at its
+            # own end-of-text token, so the padding in a batch doesn't matter
+            text_tokens = clip.tokenize(batch).to(device)
+            embeddings = model.encode_text(text_tokens)
 
-            # Convert PyTorch tensor to a standard Python list of floats for JSON
-            # .squeeze() removes the batch dimension [1, 512] -> [512]
-            node["vector"] = embedding.squeeze().cpu().tolist()
+            # Stored as float32, whatever precision the model ran in
+            vectors[start:start + len(batch)] = embeddings.float().cpu().numpy()
+            for row, word in enumerate(batch, start):
+                for n in nodes_by_word[word]:
+                    n["vector_idx"] = row
 
-    # Dig into the children
-    for child in node.get("children", []):
-        add_clip_embeddings(child, model, device)
+    vectors.flush()
 
 
 # --- EXECUTION ---
@@ -222,6 +279,7 @@ if __name__ == "__main__":
     INPUT_DIRECTORY = "pokemon_type_concepts"
     YAML_FILE = "pokemon_type_concepts/creatures.yaml"
     JSON_OUTPUT = "pokemon_type_concepts/creatures.json"
+    VECTORS_OUTPUT = "pokemon_type_concepts/creatures_vectors.npy"
 
     # Use a SET so words are globally deduplicated
     global_missing_words = set()
@@ -232,7 +290,7 @@ if __name__ == "__main__":
     # 1. Parse the main YAML tree
     print(f"Parsing {YAML_FILE}...")
     with open(YAML_FILE, 'r', encoding='utf-8') as f:
-        yaml_data = yaml.safe_load(f)
+        yaml_data = yaml.load(f, Loader=YamlLoader)
 
     json_tree = process_node(yaml_data, ipa_dict, global_missing_words)
 
@@ -247,18 +305,20 @@ if __name__ == "__main__":
 
     # 4. Compute CLIP Embeddings
     print("\nLoading PyTorch CLIP model for text embeddings...")
-    device = "cpu"
+    # On CUDA, clip.load keeps the weights in float16 (it only casts them to
+    # float32 for CPU), so the GPU path already runs half-precision matmuls
+    device = "cuda" if torch.cuda.is_available() else "cpu"
     clip_model, _ = clip.load("ViT-B/32", device=device)
     clip_model.eval()
 
     print("Computing 512-dimensional semantic vectors for searchable nodes...")
-    add_clip_embeddings(json_tree, clip_model, device)
+    add_clip_embeddings(json_tree, clip_model, device, VECTORS_OUTPUT)
 
     # 5. Export everything
-    with open(JSON_OUTPUT, 'w', encoding='utf-8') as f:
-        json.dump(json_tree, f, ensure_ascii=False, indent=2)
+    write_json(JSON_OUTPUT, json_tree)
 
-    print(f"\nSuccessfully saved unified tree with CLIP vectors to {JSON_OUTPUT}")
+    print(f"\nSuccessfully saved unified tree to {JSON_OUTPUT} "
+          f"with its CLIP vectors in {VECTORS_OUTPUT}")
 
     # 6. Print out the unified missing words
     if global_missing_words:
@@ -0,0 +1,85 @@
+import keras
+from keras import layers
+
+
+# Custom layers used by train.py's build_transformer. Anything that loads a
+# saved model (inference.py, js_conversion.py, ...) imports this module so the
+# classes are registered before keras.models.load_model runs.
+
+
+@keras.saving.register_keras_serializable(package="pokemanteu")
+class ReversibleEmbedding(layers.Embedding):
+    """
+    Token embedding that can also run in reverse: called with reverse=True it
+    projects features back onto the vocabulary with the transposed embedding
+    matrix, so the output layer shares (ties) the embedding weights. The
+    reverse projection always runs in float32, so under a mixed precision
+    policy the logits are not rounded to the compute dtype.
+    """
+
+    def call(self, inputs, reverse=False):
+        if reverse:
+            inputs = keras.ops.cast(inputs, "float32")
+            embeddings = keras.ops.cast(self.embeddings, "float32")
+            return keras.ops.matmul(inputs, keras.ops.transpose(embeddings))
+        return super().call(inputs)
+
+    def compute_mask(self, inputs, mask=None):
+        # Only (batch, length) token IDs carry padding; the (batch, length,
+        # dim) features projected in reverse have no mask of their own.
+        if len(inputs.shape) > 2:
+            return None
+        return super().compute_mask(inputs, mask)
+
+    def compute_output_shape(self, input_shape, reverse=False):
+        if reverse:
+            return (*input_shape[:-1], self.input_dim)
+        return super().compute_output_shape(input_shape)
+
+    def compute_output_spec(self, inputs, reverse=False):
+        if reverse:
+            return keras.KerasTensor(
+                self.compute_output_shape(inputs.shape, reverse=True),
+                dtype="float32",
+            )
+        return super().compute_output_spec(inputs)
+
+
+@keras.saving.register_keras_serializable(package="pokemanteu")
+class PositionalEmbedding(layers.Layer):
+    """
+    Adds a learned vector per position to (batch, length, dim) features.
+    The table holds max_len positions and any shorter input uses its first
+    rows, so the encoder and the (max_len - 1 step) decoder can share one.
+    """
+
+    def __init__(self, max_len, **kwargs):
+        super().__init__(**kwargs)
+        self.max_len = max_len
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        self.embeddings = self.add_weight(
+            name="embeddings", shape=(self.max_len, input_shape[-1]),
+            initializer="uniform")
+
+    def call(self, inputs):
+        positions = self.embeddings[:keras.ops.shape(inputs)[1]]
+        return inputs + keras.ops.cast(positions, inputs.dtype)
+
+    def get_config(self):
+        config = super().get_config()
+        config["max_len"] = self.max_len
+        return config
+
+
+def with_softmax(model):
+    """
+    Returns `model` with a float32 softmax on top of its logits, for
+    inference and export (build_transformer trains on logits). Older saved
+    models that already end in a softmax are returned unchanged.
+    """
+    if getattr(model.layers[-1], "activation", None) is keras.activations.softmax:
+        return model
+    outputs = layers.Activation("softmax", dtype="float32")(model.output)
+    return keras.Model(model.inputs, outputs)
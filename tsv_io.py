@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared readers for the word<TAB>IPA dictionaries (pokemon.tsv, en_US.tsv, ...)
+# used by train.py, poke_markov.py and transform_type_concepts.py.
+
+# Part of the load_ipa_dictionaries cache key. Bump it whenever the parsing or
+# IPA cleaning changes, so maps cached by older code are rebuilt.
+IPA_MAP_CACHE_VERSION = 1
+
+
+def split_tsv_columns(text):
+    """
+    Splits word<TAB>IPA text into a column of lowercased, stripped words and
+    a column of IPA fields with "/" and spaces removed. The IPA fields may
+    still hold several comma-separated variants. Lines without exactly two
+    fields are skipped.
+    """
+    words, ipa_fields = [], []
+    for line in text.split('\n'):
+        parts = line.strip().split('\t')
+        if len(parts) == 2:
+            words.append(parts[0])
+            ipa_fields.append(parts[1])
+    if not words:
+        return [], []
+
+    # Clean each column once rather than once per line (on one long string,
+    # chained replace beats translate); neither touches the newlines the
+    # joined columns are split back on.
+    words = list(map(str.strip, "\n".join(words).lower().split("\n")))
+    ipa_fields = "\n".join(ipa_fields).replace("/", "").replace(" ", "").split("\n")
+    return words, ipa_fields
+
+
+def read_tsv_columns(path):
+    """split_tsv_columns() over the contents of a UTF-8 TSV file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return split_tsv_columns(f.read())
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def load_ipa_dictionaries(tsv_paths, cache_dir=".cache"):
+    """
+    Loads multiple TSVs into a single fast lookup dictionary.
+    Files are processed in order; the first file to define a word wins.
+
+    The merged dictionary is pickled under cache_dir, keyed by the paths,
+    their sizes and modification times and IPA_MAP_CACHE_VERSION, so repeat
+    runs over unchanged files skip the parsing. Pass cache_dir=None to always
+    rebuild.
+    """
+    if cache_dir is None:
+        return _build_ipa_map(tsv_paths)
+
+    stats = [
+        (path, os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        if os.path.exists(path) else (path, None, None)
+        for path in tsv_paths
+    ]
+    key = hashlib.sha1(
+        repr((IPA_MAP_CACHE_VERSION, stats)).encode("utf-8")).hexdigest()
+    cache_path = os.path.join(cache_dir, f"ipa_map_{key}.pkl")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            ipa_map = pickle.load(f)
+        print(f"Loaded cached dictionary {cache_path} ({len(ipa_map)} words).\n")
+        return ipa_map
+
+    ipa_map = _build_ipa_map(tsv_paths)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename, so an interrupted run never leaves a truncated cache
+    with open(cache_path + ".tmp", "wb") as f:
+        pickle.dump(ipa_map, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + ".tmp", cache_path)
+    return ipa_map
+
+
+def _build_ipa_map(tsv_paths):
+    ipa_map = {}
+    found_paths = [path for path in tsv_paths if os.path.exists(path)]
+
+    # Read the files on a thread pool so their I/O overlaps. Parsing stays on
+    # this thread (it holds the GIL anyway) and consumes them in order.
+    with ThreadPoolExecutor(max_workers=max(len(found_paths), 1)) as executor:
+        texts = executor.map(_read_text, found_paths)
+
+        for tsv_path in tsv_paths:
+            if tsv_path not in found_paths:
+                print(f"Warning: Could not find {tsv_path}. Skipping.")
+                continue
+
+            print(f"Loading dictionary from {tsv_path}...")
+            added_from_file = 0
+
+            # Unlike split_tsv_columns, check each word before cleaning its
+            # IPA: most rows of the later files are words already defined
+            # by an earlier one, and those skip the string work entirely.
+            for line in next(texts).split('\n'):
+                parts = line.strip().split('\t')
+                if len(parts) >= 2:
+                    word = parts[0].lower().strip()
+
+                    # Only add if we haven't seen this word in an earlier TSV
+                    if word not in ipa_map:
+                        clean_ipa = parts[1].split(',', 1)[0].replace(
+                            "/", "").replace(" ", "").strip()
+
+                        if clean_ipa:
+                            ipa_map[word] = clean_ipa
+                            added_from_file += 1
+
+            print(f"  -> Added {added_from_file} new words from this file.")
+
+    print(f"\nFinished building dictionary. Total unique words: {len(ipa_map)}\n")
+    return ipa_map